@@ -1,206 +1,277 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+
 import pandas as pd
-import seaborn as sns
+import matplotlib
+matplotlib.use('Agg')  # GUIを使わないバックエンド（ワーカープロセスでも安全に描画できる）
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import japanize_matplotlib
 import numpy as np
 from pathlib import Path
 
-# データの読み込みと前処理
-def load_and_preprocess_data(file_path):
+# グラフの描画に使う Figure（pyplot の管理外で使い回すため plt.close() は不要）
+FIG = Figure()
+
+# 時間帯の順序を定義（CSVの時間帯の列と同じ並び）
+TIME_ORDER = [
+    '始発-6時台', '7時前半', '7時後半', '8時前半', '8時後半',
+    '9時前半', '9時後半', '10時台', '11-12時台', '13-14時台',
+    '15-16時台', '17時台', '18時台', '19時台', '20時台',
+    '21時台', '22時台', '23時台', '24時以降'
+]
+
+# Figure を初期化し、指定サイズの Axes を作成
+def new_axes(figsize):
+    FIG.clear()
+    FIG.set_size_inches(figsize)
+    return FIG.subplots()
+
+# データの読み込みと前処理（時間帯を列に持つ横長形式のまま返す）
+# ファイルが更新されていなければ前回の読み込み結果を使い回す
+def load_wide_data(file_path):
+    df = _load_wide_data(str(file_path), os.path.getmtime(file_path))
+    # キャッシュ内のデータが呼び出し側で変更されないようにコピーを返す
+    return df.copy()
+
+@lru_cache(maxsize=4)
+def _load_wide_data(file_path, mtime):
+    # 実際の列名を使用（「始発～6:59」などの時間帯の列は表示用の名前で読み込む）
+    id_columns = ['事業者名', '路線', '方向', '発駅', '着駅']
+    
     # ヘッダーを飛ばして2行目からデータを読み込む
-    df = pd.read_csv(file_path, encoding='utf-8', skiprows=1)
-    
-    # 実際の列名を使用
-    new_columns = [
-        '事業者名', '路線', '方向', '発駅', '着駅',
-        '始発～6:59', '7:00～7:29', '7:30～7:59', '8:00～8:29', '8:30～8:59',
-        '9:00～9:29', '9:30～9:59', '10:00～10:59', '11:00～12:59', '13:00～14:59',
-        '15:00～16:59', '17:00～17:59', '18:00～18:59', '19:00～19:59', '20:00～20:59',
-        '21:00～21:59', '22:00～22:59', '23:00～23:59', '24:00～終発'
-    ]
-    df.columns = new_columns
+    # カンマ区切りの数値はCSVパーサーで直接数値に変換する
+    # （pyarrow エンジンは thousands に対応せず、改行を含むヘッダーも読み飛ばせないため C エンジンを使う）
+    df = pd.read_csv(
+        file_path,
+        engine='c',
+        encoding='utf-8',
+        skiprows=1,
+        header=0,
+        names=id_columns + TIME_ORDER,
+        thousands=',',
+        dtype={col: 'float32' for col in TIME_ORDER},
+        na_values=['-', '']
+    )
     
     # 空白を前の有効な値で埋める（事業者名、路線、方向）
     fill_columns = ['事業者名', '路線', '方向']
-    for col in fill_columns:
-        df[col] = df[col].fillna(method='ffill')
-        
+    df[fill_columns] = df[fill_columns].ffill()
+    
     # 発駅と着駅が両方空白の行を削除
     df = df.dropna(subset=['発駅', '着駅'], how='all')
     
-    # 数値データのカンマを除去して数値に変換
-    for col in df.columns[5:]:  # 時間帯の列のみを処理
-        df[col] = pd.to_numeric(df[col].str.replace(',', ''), errors='coerce')
+    # 発駅と着駅の空白を処理
+    df['発駅'] = df['発駅'].fillna('')
+    df['着駅'] = df['着駅'].fillna('')
+    
+    # 文字列の列をカテゴリ型に変換（集計時のハッシュ計算を削減）
+    for col in ['事業者名', '路線', '方向', '発駅', '着駅']:
+        df[col] = df[col].astype('category')
+    
+    # 駅間は発駅と着駅のコードの組から作成（文字列の連結は組の種類数だけ行う）
+    from_stations = df['発駅'].cat.categories
+    to_stations = df['着駅'].cat.categories
+    pair_codes = df['発駅'].cat.codes.to_numpy(np.int64) * len(to_stations) + df['着駅'].cat.codes.to_numpy(np.int64)
+    # 組の一覧は駅名順に並べておく（平均が同値の駅間があるとき、レポートの最多駅間を駅名順で決めるため）
+    pairs, section_codes = np.unique(pair_codes, return_inverse=True)
+    sections = from_stations[pairs // len(to_stations)] + '-' + to_stations[pairs % len(to_stations)]
+    df['駅間'] = pd.Categorical.from_codes(section_codes, categories=sections)
     
-    # データを長形式（ロング形式）に変換
+    return df.reset_index(drop=True)
+
+# 横長形式のデータを長形式（ロング形式）に変換
+def to_long_format(df):
     df_melted = df.melt(
-        id_vars=['事業者名', '路線', '方向', '発駅', '着駅'],
+        id_vars=['事業者名', '路線', '方向', '発駅', '着駅', '駅間'],
+        value_vars=TIME_ORDER,
         var_name='時間帯',
         value_name='輸送人員'
     )
     
-    # 時間帯の順序を定義
-    time_order = [
-        '始発-6時台', '7時前半', '7時後半', '8時前半', '8時後半',
-        '9時前半', '9時後半', '10時台', '11-12時台', '13-14時台',
-        '15-16時台', '17時台', '18時台', '19時台', '20時台',
-        '21時台', '22時台', '23時台', '24時以降'
-    ]
-    
-    # 時間帯を文字列にマッピング
-    time_mapping = {
-        '始発～6:59': '始発-6時台',
-        '7:00～7:29': '7時前半',
-        '7:30～7:59': '7時後半',
-        '8:00～8:29': '8時前半',
-        '8:30～8:59': '8時後半',
-        '9:00～9:29': '9時前半',
-        '9:30～9:59': '9時後半',
-        '10:00～10:59': '10時台',
-        '11:00～12:59': '11-12時台',
-        '13:00～14:59': '13-14時台',
-        '15:00～16:59': '15-16時台',
-        '17:00～17:59': '17時台',
-        '18:00～18:59': '18時台',
-        '19:00～19:59': '19時台',
-        '20:00～20:59': '20時台',
-        '21:00～21:59': '21時台',
-        '22:00～22:59': '22時台',
-        '23:00～23:59': '23時台',
-        '24:00～終発': '24時以降'
-    }
-    df_melted['時間帯'] = df_melted['時間帯'].map(time_mapping)
-    
     # 時間帯を順序付きカテゴリ型に変換
-    df_melted['時間帯'] = pd.Categorical(df_melted['時間帯'], categories=time_order, ordered=True)
-    
-    # 発駅と着駅の空白を処理
-    df_melted['発駅'] = df_melted['発駅'].fillna('')
-    df_melted['着駅'] = df_melted['着駅'].fillna('')
-    df_melted['駅間'] = df_melted['発駅'] + '-' + df_melted['着駅']
+    # melt は時間帯の列を順に縦に積むため、列番号をそのままカテゴリのコードとして使える
+    time_codes = np.repeat(np.arange(len(TIME_ORDER)), len(df))
+    df_melted['時間帯'] = pd.Categorical.from_codes(time_codes, categories=TIME_ORDER, ordered=True)
     
-    # 輸送人員が欠損している行のみを削除
-    df_melted = df_melted.dropna(subset=['輸送人員'])
+    # 輸送人員が欠損している行のみを削除（数値の列だけを確認する）
+    df_melted = df_melted[~np.isnan(df_melted['輸送人員'].to_numpy())]
     
-    return df_melted
+    return df_melted[['事業者名', '路線', '方向', '発駅', '着駅', '時間帯', '輸送人員', '駅間']]
 
-# ヒートマップの作成
-def create_heatmap(df, line_name, direction, start_company='京阪電気鉄道'):
-    # 時間帯の順序を定義
-    time_order = [
-        '始発-6時台', '7時前半', '7時後半', '8時前半', '8時後半',
-        '9時前半', '9時後半', '10時台', '11-12時台', '13-14時台',
-        '15-16時台', '17時台', '18時台', '19時台', '20時台',
-        '21時台', '22時台', '23時台', '24時以降'
-    ]
-    
-    # 京阪電気鉄道以降のデータを抽出
-    start_idx = df[df['事業者名'] == start_company].index[0]
-    filtered_df = df.iloc[start_idx:]
-    
-    # 特定の路線と方向のデータを抽出
-    line_data = filtered_df[
-        (filtered_df['路線'] == line_name) & 
-        (filtered_df['方向'] == direction)
-    ]
-    
-    # 駅間と時間帯のピボットテーブル作成
-    pivot_data = pd.pivot_table(
-        line_data,
-        values='輸送人員',
-        index='発駅',
-        columns='時間帯',
-        aggfunc='mean'
+# データの読み込みと前処理（長形式で返す）
+def load_and_preprocess_data(file_path):
+    return to_long_format(load_wide_data(file_path))
+
+# 時間帯の値を (行数, 時間帯数) の行列として取り出す
+def get_time_values(df):
+    return df[TIME_ORDER].to_numpy(dtype=np.float32)
+
+# 時間帯別の平均輸送人員を計算（欠損値は除く）
+def mean_by_hour(values):
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    sums = np.nansum(values, axis=0, dtype=np.float64)
+    observed = counts > 0
+    return pd.Series(sums[observed] / counts[observed], index=pd.Index(TIME_ORDER)[observed])
+
+# カテゴリ列の値ごとに平均輸送人員を計算（全時間帯の欠損値以外の平均）
+def mean_by_category(df, col, values):
+    codes = df[col].cat.codes.to_numpy()
+    categories = df[col].cat.categories
+    row_sums = np.nansum(values, axis=1, dtype=np.float64)
+    row_counts = np.count_nonzero(~np.isnan(values), axis=1)
+    sums = np.bincount(codes, weights=row_sums, minlength=len(categories))
+    counts = np.bincount(codes, weights=row_counts, minlength=len(categories))
+    observed = counts > 0
+    return pd.Series(sums[observed] / counts[observed], index=categories[observed])
+
+# グループごとの時間帯別平均を計算（欠損値は除き、値のない組は NaN）
+def grouped_mean(codes, values, n_groups):
+    n_cols = values.shape[1]
+    valid = ~np.isnan(values)
+    # (グループ, 時間帯) の組を1次元のキーにして、合計と件数を一度に集計する
+    keys = (codes[:, None] * n_cols + np.arange(n_cols)).ravel()
+    sums = np.bincount(keys, weights=np.where(valid, values, 0).ravel(), minlength=n_groups * n_cols)
+    counts = np.bincount(keys, weights=valid.ravel(), minlength=n_groups * n_cols)
+    with np.errstate(invalid='ignore'):
+        return (sums / counts).reshape(n_groups, n_cols)
+
+# 路線・方向・発駅ごとの時間帯別平均輸送人員を一度に計算
+def aggregate_station_hours(df, values):
+    key_columns = ['路線', '方向', '発駅']
+    # 発駅はデータフレームの順序（路線順）のまま残す
+    codes, keys = pd.factorize(pd.MultiIndex.from_frame(df[key_columns]))
+    return pd.DataFrame(
+        grouped_mean(codes, values, len(keys)),
+        index=keys.set_names(key_columns),
+        columns=TIME_ORDER
+    ).dropna(how='all')
+
+# 集計結果から特定の路線と方向の発駅×時間帯の表を切り出す
+def select_station_hours(station_hours, line_name, direction):
+    rows = (
+        (station_hours.index.get_level_values('路線') == line_name) &
+        (station_hours.index.get_level_values('方向') == direction)
     )
-    
-    # 駅の順序を取得（データフレームの順序を使用）
-    station_order = line_data['発駅'].unique()
-    
-    # ピボットテーブルを路線順に並び替え
-    pivot_data = pivot_data.reindex(index=station_order, columns=time_order)
-    
+    return station_hours[rows].droplevel(['路線', '方向'])
+
+# ヒートマップの作成
+def create_heatmap(pivot_data, line_name, direction):
     # データが空の場合は処理を中断
     if pivot_data.empty:
         print(f"警告: {line_name}（{direction}）のデータが見つかりません")
         return
     
     # プロットサイズの設定
-    plt.figure(figsize=(15, len(pivot_data)/2))
+    ax = new_axes((15, len(pivot_data)/2))
     
     # ヒートマップの作成
-    sns.heatmap(
-        pivot_data,
-        cmap='YlOrRd',
-        fmt='.0f',
-        cbar_kws={'label': '輸送人員（人）'}
-    )
+    values = pivot_data.to_numpy()
+    image = ax.imshow(values, cmap='YlOrRd', aspect='auto', interpolation='nearest')
+    FIG.colorbar(image, ax=ax, label='輸送人員（人）')
+    ax.set_xticks(range(values.shape[1]), pivot_data.columns)
+    ax.set_yticks(range(values.shape[0]), pivot_data.index)
+    
+    # セル数が少ない場合のみ数値を表示（文字列と文字色はまとめて作成する）
+    if values.size <= 400:
+        labels = np.char.mod('%.0f', values)
+        colors = np.where(values > np.nanmean(values), 'white', 'black')
+        for (i, j), label in np.ndenumerate(labels):
+            if not np.isnan(values[i, j]):
+                ax.text(j, i, label, ha='center', va='center', color=colors[i, j], fontsize=8)
     
     # x軸のラベルを調整
-    plt.xticks(rotation=45, ha='right')
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
     
-    plt.title(f'{line_name}（{direction}）時間帯別輸送人員ヒートマップ')
-    plt.xlabel('時間帯')
-    plt.ylabel('発駅')
-    plt.tight_layout()
-    plt.savefig(f'heatmap_{line_name}_{direction}.png')
-    plt.close()
+    ax.set_title(f'{line_name}（{direction}）時間帯別輸送人員ヒートマップ')
+    ax.set_xlabel('時間帯')
+    ax.set_ylabel('発駅')
+    FIG.tight_layout()
+    FIG.savefig(f'heatmap_{line_name}_{direction}.png')
+
+# 発駅または着駅に指定駅が含まれる行のマスクを作成
+def create_station_mask(df, station_name):
+    mask = np.zeros(len(df), dtype=bool)
+    for col in ['発駅', '着駅']:
+        # 駅名の一覧（カテゴリ）だけを検索し、コードで各行に展開する
+        hits = np.asarray(df[col].cat.categories.str.contains(station_name, regex=False))
+        codes = df[col].cat.codes.to_numpy()
+        mask |= hits[codes] & (codes >= 0)
+    return mask
 
 # 特定駅の時間帯別輸送人員の折れ線グラフ
-def create_station_timeline(df, station_name):
-    # 発駅または着駅に指定駅が含まれるデータを抽出
-    station_data = df[df['発駅'].str.contains(station_name, na=False) | 
-                     df['着駅'].str.contains(station_name, na=False)]
-    timeline = station_data.groupby('時間帯')['輸送人員'].mean()
-    
-    plt.figure(figsize=(12, 6))
-    plt.plot(timeline.index, timeline.values, marker='o')
-    plt.title(f'{station_name}の時間帯別輸送人員')
-    plt.xticks(rotation=45, ha='right')
-    plt.xlabel('時間帯')
-    plt.ylabel('平均輸送人員（人）')
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig('station_timeline.png')
-    plt.close()
+def create_station_timeline(timeline, station_name):
+    ax = new_axes((12, 6))
+    ax.plot(timeline.index, timeline.values, marker='o')
+    ax.set_title(f'{station_name}の時間帯別輸送人員')
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+    ax.set_xlabel('時間帯')
+    ax.set_ylabel('平均輸送人員（人）')
+    ax.grid(True)
+    FIG.tight_layout()
+    FIG.savefig('station_timeline.png')
 
 # 路線別平均輸送人員の棒グラフ
-def create_line_comparison(df):
-    line_avg = df.groupby('路線')['輸送人員'].mean().sort_values(ascending=False)
-    
-    plt.figure(figsize=(12, 6))
-    line_avg.plot(kind='bar')
-    plt.title('路線別平均輸送人員')
-    plt.xlabel('路線')
-    plt.ylabel('平均輸送人員')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig('line_comparison.png')
-    plt.close()
+def create_line_comparison(line_avg):
+    ax = new_axes((12, 6))
+    line_avg.plot(kind='bar', ax=ax)
+    ax.set_title('路線別平均輸送人員')
+    ax.set_xlabel('路線')
+    ax.set_ylabel('平均輸送人員')
+    plt.setp(ax.get_xticklabels(), rotation=45)
+    FIG.tight_layout()
+    FIG.savefig('line_comparison.png')
 
 # メイン処理
 def main():
-    # データの読み込み
-    df = load_and_preprocess_data('001179022.csv')
+    # データの読み込み（時間帯の値は行列として保持し、長形式には変換しない）
+    df = load_wide_data('001179022.csv')
+    values = get_time_values(df)
+    
+    # 事業者ごとの先頭行の位置を一度だけ求め、京阪電気鉄道以降のデータを抽出
+    is_first = ~df['事業者名'].duplicated().to_numpy()
+    first_rows = pd.Series(np.flatnonzero(is_first), index=df['事業者名'].to_numpy()[is_first])
+    start_idx = first_rows['京阪電気鉄道']
+    filtered_df = df.iloc[start_idx:]
+    
+    # 路線・方向ごとの発駅×時間帯の表は一度の集計で作成し、ヒートマップごとに切り出す
+    station_hours = aggregate_station_hours(filtered_df, values[start_idx:])
     
-    # 京阪本線の上り下りそれぞれのヒートマップを作成
+    # 京阪本線の上り下りそれぞれのヒートマップを並列に作成
+    # （ワーカーには切り出した表だけを渡す）
     line_name = '京阪本線'
-    for direction in ['下り', '上り']:
-        create_heatmap(df, line_name, direction, start_company='京阪電気鉄道')
+    directions = ['下り', '上り']
+    pivots = [select_station_hours(station_hours, line_name, d) for d in directions]
+    with ProcessPoolExecutor(max_workers=min(len(directions), os.cpu_count() or 1)) as executor:
+        list(executor.map(create_heatmap, pivots, repeat(line_name), directions))
+    
+    # 集計結果は一度だけ計算し、グラフとレポートで使い回す
+    kyoto_mask = create_station_mask(df, '京都')
+    by_hour_kyoto = mean_by_hour(values[kyoto_mask])
+    by_hour = mean_by_hour(values)
+    by_section = mean_by_category(df, '駅間', values)
+    by_line = mean_by_category(df, '路線', values).sort_values(ascending=False)
+    total_records = int(np.count_nonzero(~np.isnan(values)))
     
     # その他の処理は同じ
-    create_station_timeline(df, '京都')
-    create_line_comparison(df)
-    df.to_excel('analyzed_data.xlsx', index=False)
-    create_report(df)
-
-def create_report(df):
-    # 京都駅のデータを抽出
-    kyoto_data = df[df['発駅'].str.contains('京都', na=False) | df['着駅'].str.contains('京都', na=False)]
+    create_station_timeline(by_hour_kyoto, '京都')
+    create_line_comparison(by_line)
     
+    # 保存時のみ長形式のデータを作成
+    # （Excelは xlsxwriter で書き出し、後続処理向けに Parquet も保存する）
+    df_long = to_long_format(df)
+    with pd.ExcelWriter('analyzed_data.xlsx', engine='xlsxwriter') as writer:
+        df_long.to_excel(writer, index=False)
+    df_long.to_parquet('analyzed_data.parquet', index=False, compression='zstd')
+    create_report(total_records, by_hour, by_section, by_line, by_hour_kyoto)
+
+def create_report(total_records, by_hour, by_section, by_line, by_hour_kyoto):
     # 京都駅のピーク時間と最小時間を取得（データがある場合のみ）
-    if len(kyoto_data) > 0:
-        kyoto_peak = kyoto_data.groupby('時間帯')['輸送人員'].mean().idxmax()
-        kyoto_min = kyoto_data.groupby('時間帯')['輸送人員'].mean().idxmin()
+    if len(by_hour_kyoto) > 0:
+        kyoto_peak = by_hour_kyoto.idxmax()
+        kyoto_min = by_hour_kyoto.idxmin()
     else:
         kyoto_peak = "データなし"
         kyoto_min = "データなし"
@@ -229,15 +300,15 @@ def create_report(df):
   - 最も輸送人員が多い路線：{top_line}
   - 最も輸送人員が少ない路線：{bottom_line}
     """.format(
-        total_records=len(df),
-        total_lines=df['路線'].nunique(),
-        total_stations=df['駅間'].nunique(),
-        peak_hour=df.groupby('時間帯')['輸送人員'].mean().idxmax(),
-        busiest_section=df.groupby('駅間')['輸送人員'].mean().idxmax(),
+        total_records=total_records,
+        total_lines=len(by_line),
+        total_stations=len(by_section),
+        peak_hour=by_hour.idxmax(),
+        busiest_section=by_section.idxmax(),
         kyoto_peak=kyoto_peak,
         kyoto_min=kyoto_min,
-        top_line=df.groupby('路線')['輸送人員'].mean().idxmax(),
-        bottom_line=df.groupby('路線')['輸送人員'].mean().idxmin()
+        top_line=by_line.idxmax(),
+        bottom_line=by_line.idxmin()
     )
     
     with open('analysis_report.md', 'w', encoding='utf-8') as f:
@@ -1,75 +1,120 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # GUIを使わないバックエンド（ワーカープロセスでも安全に描画できる）
 import matplotlib.pyplot as plt
-import seaborn as sns
-import japanize_matplotlib
+from matplotlib import font_manager
+from matplotlib.figure import Figure
 from pathlib import Path
 import numpy as np
 
+# 日本語フォントが既に登録済みならそのまま使い、無い場合のみ japanize_matplotlib で登録する
+if any('IPAex' in f.name for f in font_manager.fontManager.ttflist):
+    matplotlib.rcParams['font.family'] = 'IPAexGothic'
+else:
+    import japanize_matplotlib
+
+# 画像の解像度（通常は中間成果物向け、--publication 指定時は印刷向け）
+DPI = 150
+PUBLICATION_DPI = 300
+
+# 年齢階層の列（CSVの列と同じ並び）
+AGE_COLUMNS = ['～14歳', '15～19歳', '20～24歳', '25～29歳', '30～34歳',
+               '35～39歳', '40～44歳', '45～49歳', '50～54歳', '55～59歳',
+               '60～64歳', '65～69歳', '70歳～']
+
+# ヒートマップの列（性別ごとに年齢階層と合計を並べる）
+GENDERS = ['男性', '女性']
+HEATMAP_COLUMNS = [f"{gender}_{age}" for gender in GENDERS
+                   for age in AGE_COLUMNS + ['合計']]
+
+# 描画に使い回す図（pyplot の管理外なので close は不要）
+FIG = Figure(layout='constrained')
+
+# 余白を指定した場合は固定の余白で配置し、描画時のレイアウト計算を省く
+def new_axes(figsize, margins=None):
+    FIG.clear()
+    FIG.set_size_inches(figsize)
+    if margins is None:
+        FIG.set_layout_engine('constrained')
+        return FIG.subplots()
+    FIG.set_layout_engine('none')
+    return FIG.subplots(gridspec_kw=margins)
+
 def load_and_clean_data(file_path):
     """データの読み込みとクリーニングを行う関数"""
-    # CSVファイルを読み込む
-    df = pd.read_csv(file_path, encoding='utf-8', thousands=',', skiprows=3)
+    age_columns = AGE_COLUMNS
+    
+    # クリーニング済みのキャッシュがCSVより新しければそれを使う
+    cache = Path(file_path).with_suffix('.parquet')
+    if cache.exists() and cache.stat().st_mtime >= Path(file_path).stat().st_mtime:
+        return pd.read_parquet(cache, engine='pyarrow'), age_columns
+    
+    # CSVファイルを読み込む（必要な列のみ、年齢列はパーサーで直接数値に変換）
+    df = pd.read_csv(
+        file_path,
+        encoding='utf-8',
+        thousands=',',
+        skiprows=3,
+        usecols=['通勤・通学', '性別', '地域'] + age_columns,
+        dtype={col: 'float64' for col in age_columns},
+        na_values=['-', '']
+    )
     
-    # 不要な行を削除
-    df = df.dropna(how='all')
-    df = df[df['通勤・通学'].notna()]
-    df = df[df['性別'] != '不明']
+    # 不要な行（空行と性別が不明の行）を一度に削除
+    # （通勤・通学が空の行は他の列もすべて空なので、dropna(how='all') は不要）
+    df = df[df['通勤・通学'].notna() & df['性別'].ne('不明')]
     
-    # 年齢列を定義
-    age_columns = ['～14歳', '15～19歳', '20～24歳', '25～29歳', '30～34歳', 
-                  '35～39歳', '40～44歳', '45～49歳', '50～54歳', '55～59歳',
-                  '60～64歳', '65～69歳', '70歳～']
+    # 人数は整数で扱う（欠損があるのは削除した空行のみ）
+    df[age_columns] = df[age_columns].astype('int64')
     
-    # 数値変換
-    for col in age_columns:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
+    # 絞り込みに使う列はカテゴリ型に変換（比較がコードの比較になる）
+    for col in ['通勤・通学', '性別', '地域']:
+        df[col] = df[col].astype('category')
+    
+    # 次回以降はCSVの解析を省略できるようにキャッシュを保存
+    df.to_parquet(cache, engine='pyarrow', compression='zstd')
     
     return df, age_columns
 
-def create_commute_age_plot(df, age_columns, output_dir):
-    """通勤者の年齢分布グラフを作成"""
-    plt.figure(figsize=(15, 8))
-    commute_data = (df[(df['通勤・通学'] == '通勤') & (df['地域'] == '近畿圏計')]
-                   .groupby('性別')[age_columns].sum())
-    
-    ax = commute_data.T.plot(kind='bar', stacked=True)
-    plt.title('年齢階層別の通勤者数（性別）')
-    plt.xlabel('年齢階層')
-    plt.ylabel('人数')
-    
-    # 数値ラベルの追加
-    for c in ax.containers:
-        ax.bar_label(c, fmt='%.0f', label_type='center')
-    
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(output_dir / 'commute_by_age_gender.png', dpi=300)
-    plt.close()
+def create_commute_age_plot(commute_data, output_dir, dpi=DPI, ax=None):
+    """通勤者の年齢分布グラフを作成（年齢階層×性別の集計済みデータを描画）"""
+    if ax is None:
+        ax = new_axes((12, 6))
+    
+    commute_data.plot(kind='bar', stacked=True, ax=ax)
+    ax.set_title('年齢階層別の通勤者数（性別）')
+    ax.set_xlabel('年齢階層')
+    ax.set_ylabel('人数')
+    
+    # 数値ラベルの追加（積み上げ棒の上端に合計のみ表示）
+    totals = commute_data.sum(axis=1)
+    ax.bar_label(ax.containers[-1], labels=[f'{v:,}' for v in totals.tolist()], label_type='edge')
+    
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.figure.savefig(output_dir / 'commute_by_age_gender.png', dpi=dpi)
 
-def verify_data(df, target_regions, age_columns, output_dir):
+def verify_data(sums, target_regions, age_columns, output_dir):
     """データの正確性を検証"""
-    # 検証結果をファイルに書き出す
+    # 検証結果をまとめて作成し、ファイルに一度で書き出す
     verification_file = output_dir / 'data_verification.txt'
     
-    with open(verification_file, 'w', encoding='utf-8') as f:
-        f.write("データ検証結果:\n")
-        f.write("-" * 50 + "\n")
+    lines = ["データ検証結果:\n", "-" * 50 + "\n"]
+    for i, region in enumerate(target_regions):
+        lines.append(f"\n{region}:\n")
         
-        for region in target_regions:
-            f.write(f"\n{region}:\n")
-            region_data = df[df['地域'] == region]
-            
-            for gender in ['男性', '女性']:
-                gender_data = region_data[region_data['性別'] == gender]
-                f.write(f"\n{gender}:\n")
-                for age in age_columns:
-                    value = gender_data[age].sum()
-                    f.write(f"{age}: {value:,}\n")
-                f.write(f"合計: {gender_data[age_columns].sum().sum():,}\n")
+        for g, gender in enumerate(GENDERS):
+            lines.append(f"\n{gender}:\n")
+            lines += [f"{age}: {value:,}\n" for age, value in zip(age_columns, sums[i, g].tolist())]
+            lines.append(f"合計: {sums[i, g].sum():,}\n")
+    
+    verification_file.write_text(''.join(lines), encoding='utf-8')
     
     print(f"検証結果を {verification_file} に保存しました。")
 
-def create_region_heatmap(df, age_columns, output_dir):
+def create_region_heatmap(df, age_columns, output_dir, dpi=DPI, ax=None):
     """主要地域の通勤者数ヒートマップを作成"""
     target_regions = [
         '大阪北東部',
@@ -79,86 +124,86 @@ def create_region_heatmap(df, age_columns, output_dir):
         '京都南部',
         '近畿圏計'
     ]
+    genders = GENDERS
+    
+    # 地域・性別を対象の並びのコードに変換（対象外は -1）
+    region_codes = df['地域'].cat.set_categories(target_regions).cat.codes.to_numpy()
+    gender_codes = df['性別'].cat.set_categories(genders).cat.codes.to_numpy()
+    rows = (region_codes >= 0) & (gender_codes >= 0)
+    
+    # 地域・性別ごとの年齢層別人数を一度に集計（検証とヒートマップで共用）
+    # (地域×性別, 行) の 0/1 行列と (行, 年齢層) の人数の行列積で全グループを一度に合計する
+    n_groups = len(target_regions) * len(genders)
+    key = region_codes[rows].astype(np.int64) * len(genders) + gender_codes[rows]
+    membership = (key == np.arange(n_groups)[:, None]).astype(np.float64)
+    sums = membership @ df[age_columns].to_numpy(dtype=np.float64)[rows]
+    # 人数は最後にまとめて整数に変換する
+    sums = sums.astype(np.int64).reshape(len(target_regions), len(genders), len(age_columns))
     
     # データの検証を実行
-    verify_data(df, target_regions, age_columns, output_dir)
+    verify_data(sums, target_regions, age_columns, output_dir)
     
-    plt.figure(figsize=(30, 10))
+    if ax is None:
+        # 図の大きさと列ラベルは固定なので、回転した列ラベルが収まる余白を直接指定する
+        ax = new_axes((30, 10), margins=dict(left=0.04, right=0.99, top=0.93, bottom=0.12))
     
-    # データ準備（検証と同じ方法で）
-    data_dict = {}
+    # データ準備（性別ごとに年齢層別の人数と合計を横に並べる）
+    # (地域, 性別, 年齢層+合計) を作って性別の軸を列方向に畳む
+    with_totals = np.concatenate([sums, sums.sum(axis=-1, keepdims=True)], axis=-1)
     
-    for region in target_regions:
-        region_data = df[df['地域'] == region]
-        
-        for gender in ['男性', '女性']:
-            gender_data = region_data[region_data['性別'] == gender]
-            
-            # 年齢層ごとのデータを追加
-            for age in age_columns:
-                value = int(gender_data[age].sum())  # 整数に変換
-                data_dict[(region, f"{gender}_{age}")] = value
-            
-            # 合計を追加
-            total = int(gender_data[age_columns].sum().sum())  # 整数に変換
-            data_dict[(region, f"{gender}_合計")] = total
-    
-    # DataFrameに変換
-    columns = [f"{gender}_{age}" for gender in ['男性', '女性'] 
-              for age in age_columns + ['合計']]
+    columns = HEATMAP_COLUMNS
     heatmap_data = pd.DataFrame(
-        [[data_dict.get((region, col), 0) for col in columns] 
-         for region in target_regions],
+        with_totals.reshape(len(target_regions), -1),
         index=target_regions,
         columns=columns
     )
     
-    # カラースケールの調整
-    data_values = heatmap_data.values.flatten()
-    data_values = data_values[data_values != 0]
-    
-    vmin = np.percentile(data_values, 1)
-    vmax = np.percentile(data_values, 99)
+    # カラースケールの調整（0 を除いた値の 1%/99% 点を一度に求める）
+    values = heatmap_data.to_numpy()
+    vmin, vmax = np.percentile(values[values != 0], [1, 99])
     
     # ヒートマップの作成
-    sns.heatmap(heatmap_data, 
-                annot=True, 
-                fmt=',d',
-                cmap='YlOrRd',
-                cbar_kws={'label': '通勤者数'},
-                xticklabels=True,
-                square=False,
-                annot_kws={'size': 8},
-                vmin=vmin,
-                vmax=vmax,
-                center=None,
-                robust=True)
-    
-    plt.title('地域別の性別・年齢層別通勤者数', pad=20)
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    plt.savefig(output_dir / 'commute_heatmap_detailed.png', dpi=300, bbox_inches='tight')
-    plt.close()
+    image = ax.imshow(values, cmap='YlOrRd', aspect='auto', interpolation='nearest',
+                      vmin=vmin, vmax=vmax, rasterized=True)
+    ax.figure.colorbar(image, ax=ax, label='通勤者数', pad=0.01)
+    ax.set_xticks(range(len(columns)), columns)
+    ax.set_yticks(range(len(target_regions)), target_regions)
+    
+    # セルに数値を表示（文字列と文字色はまとめて作成する）
+    labels = [f'{v:,}' for v in values.ravel().tolist()]
+    colors = np.where(values > (vmin + vmax) / 2, 'white', 'black').ravel()
+    for (i, j), label, color in zip(np.ndindex(values.shape), labels, colors):
+        ax.text(j, i, label, ha='center', va='center', color=color, fontsize=8)
+    
+    ax.set_title('地域別の性別・年齢層別通勤者数', pad=20)
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+    # 大きな図なので PNG より小さく済む可逆圧縮の WebP で保存する
+    ax.figure.savefig(output_dir / 'commute_heatmap_detailed.webp', dpi=dpi,
+                      pil_kwargs={'lossless': True})
 
-def create_student_age_plot(df, age_columns, output_dir):
-    """通学者の年齢分布グラフを作成"""
-    plt.figure(figsize=(15, 8))
-    student_data = (df[(df['通勤・通学'] == '通学') & (df['地域'] == '近畿圏計')]
-                   .groupby('性別')[age_columns].sum())
-    
-    ax = student_data.T.plot(kind='line', marker='o')
-    
-    plt.title('年齢階層別の通学者数（性別）')
-    plt.xlabel('年齢階層')
-    plt.ylabel('人数')
-    plt.xticks(rotation=45)
-    plt.legend(title='性別')
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(output_dir / 'student_by_age_gender.png', dpi=300)
-    plt.close()
+def create_student_age_plot(student_data, output_dir, dpi=DPI, ax=None):
+    """通学者の年齢分布グラフを作成（年齢階層×性別の集計済みデータを描画）"""
+    if ax is None:
+        ax = new_axes((15, 8))
+    
+    student_data.plot(kind='line', marker='o', ax=ax)
+    
+    ax.set_title('年齢階層別の通学者数（性別）')
+    ax.set_xlabel('年齢階層')
+    ax.set_ylabel('人数')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend(title='性別')
+    ax.grid(True)
+    ax.figure.savefig(output_dir / 'student_by_age_gender.png', dpi=dpi)
 
 def main():
+    # コマンドライン引数の解析
+    parser = argparse.ArgumentParser(description='通勤・通学者数のグラフを生成する')
+    parser.add_argument('--publication', action='store_true',
+                        help=f'印刷用の解像度（{PUBLICATION_DPI}dpi）で保存する')
+    args = parser.parse_args()
+    dpi = PUBLICATION_DPI if args.publication else DPI
+    
     # 出力ディレクトリの設定
     output_dir = Path('output')
     output_dir.mkdir(exist_ok=True)
@@ -166,14 +211,25 @@ def main():
     # データの読み込みとクリーニング
     df, age_columns = load_and_clean_data('001470675-a.csv')
     
-    # グラフの生成
-    create_commute_age_plot(df, age_columns, output_dir)
-    create_region_heatmap(df, age_columns, output_dir)
-    create_student_age_plot(df, age_columns, output_dir)
+    # 近畿圏計の通勤・通学別、性別の集計を一度だけ行い、両方の年齢分布グラフで使い回す
+    # （年齢階層を行、(通勤・通学, 性別) を列とした形にしておく）
+    by_type_gender = (df[df['地域'] == '近畿圏計']
+                      .groupby(['通勤・通学', '性別'], observed=True)[age_columns].sum().T)
+    
+    # グラフの生成（互いに独立しているので別プロセスで並列に描画する）
+    tasks = [
+        (create_commute_age_plot, by_type_gender.xs('通勤', axis=1)),
+        (create_region_heatmap, df, age_columns),
+        (create_student_age_plot, by_type_gender.xs('通学', axis=1)),
+    ]
+    with ProcessPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(plot, *args, output_dir, dpi) for plot, *args in tasks]
+        for future in futures:
+            future.result()
     
     print('グラフを生成しました。output/ディレクトリ内の以下のファイルを確認してください：')
     print('- commute_by_age_gender.png')
-    print('- commute_heatmap_detailed.png')
+    print('- commute_heatmap_detailed.webp')
     print('- student_by_age_gender.png')
 
 if __name__ == '__main__':